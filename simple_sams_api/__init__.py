@@ -1,6 +1,9 @@
 from .base import (
     SAMSapi,
     extract_HPO_terms_from_phenopacket,
+    extract_HPO_terms_from_phenopackets,
     extract_disease_terms_from_phenopacket,
+    extract_disease_terms_from_phenopackets,
     filter_phenopacket_by_onset,
+    index_phenopacket_by_onset,
 )
@@ -1,10 +1,14 @@
+import json
 import unittest
 from unittest.mock import patch, MagicMock
 from simple_sams_api.base import (
     SAMSapi,
     extract_HPO_terms_from_phenopacket,
+    extract_HPO_terms_from_phenopackets,
     extract_disease_terms_from_phenopacket,
+    extract_disease_terms_from_phenopackets,
     filter_phenopacket_by_onset,
+    index_phenopacket_by_onset,
 )
 
 
@@ -33,27 +37,80 @@ class TestSAMSapi_Mocking(unittest.TestCase):
     def test_get_phenopackets(self, mock_get):
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = [{"id": "1"}]
+        mock_response.headers = {"Content-Type": "application/json"}
+        mock_response.iter_content.return_value = [json.dumps([{"id": "1"}]).encode()]
         mock_get.return_value = mock_response
         result = self.api.get_phenopackets()
         self.assertEqual(result, [{"id": "1"}])
+        # A full export populates the by-id cache so get_phenopacket is free
+        mock_response.iter_content.return_value = [
+            json.dumps([{"subject": {"id": "patient1"}}]).encode()
+        ]
+        self.api.get_phenopackets()
+        call_count = mock_get.call_count
+        result = self.api.get_phenopacket("patient1")
+        self.assertEqual(result["subject"]["id"], "patient1")
+        self.assertEqual(mock_get.call_count, call_count)
+        # invalidate evicts single entries or the whole cache
+        self.api.invalidate("patient1")
+        self.assertNotIn("patient1", self.api.phenopackets)
+        self.api.get_phenopackets()
+        self.api.invalidate()
+        self.assertEqual(self.api.phenopackets, {})
+        # Non-JSON responses (e.g. the HTML login page) raise instead of
+        # failing inside the decoder
+        mock_response.headers = {"Content-Type": "text/html"}
+        with self.assertRaises(RuntimeError):
+            self.api.get_phenopackets()
 
     @patch("requests.Session.get")
     def test_get_phenopacket(self, mock_get):
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = {
-            "subject": {"id": "patient1"},
-            "phenotypicFeatures": [],
-            "diseases": [],
-        }
+        mock_response.headers = {"Content-Type": "application/json"}
+        mock_response.content = json.dumps(
+            {
+                "subject": {"id": "patient1"},
+                "phenotypicFeatures": [],
+                "diseases": [],
+            }
+        ).encode()
         mock_get.return_value = mock_response
         result = self.api.get_phenopacket("patient1")
         self.assertEqual(result["subject"]["id"], "patient1")
+        # Repeated lookups are served from the cache without a new request
+        self.api.get_phenopacket("patient1")
+        mock_get.assert_called_once()
         # Test error case
-        mock_response.json.return_value = {"subject": {"id": "other"}}
+        mock_response.content = json.dumps({"subject": {"id": "other"}}).encode()
+        with self.assertRaises(RuntimeError):
+            self.api.get_phenopacket("patient2")
+        # A malformed body without "subject" raises the same RuntimeError
+        mock_response.content = json.dumps({"phenotypicFeatures": []}).encode()
         with self.assertRaises(RuntimeError):
-            self.api.get_phenopacket("patient1")
+            self.api.get_phenopacket("patient3")
+        # Ids with reserved characters are percent-encoded in the URL
+        mock_response.content = json.dumps({"subject": {"id": "pat ient&4"}}).encode()
+        self.api.get_phenopacket("pat ient&4")
+        self.assertIn("external_id=pat%20ient%264", mock_get.call_args[0][0])
+
+    @patch("requests.Session.get")
+    def test_get_phenopackets_by_ids(self, mock_get):
+        def fake_get(url, *args, **kwargs):
+            patient_id = url.rsplit("=", 1)[-1]
+            mock_response = MagicMock()
+            mock_response.raise_for_status.return_value = None
+            mock_response.headers = {"Content-Type": "application/json"}
+            mock_response.content = json.dumps(
+                {"subject": {"id": patient_id}}
+            ).encode()
+            return mock_response
+
+        mock_get.side_effect = fake_get
+        result = self.api.get_phenopackets_by_ids(["patient1", "patient2"])
+        self.assertEqual(
+            [p["subject"]["id"] for p in result], ["patient1", "patient2"]
+        )
 
     def test_loggedIn_property(self):
         self.api.session.cookies.set("SAMSI", "token")
@@ -77,9 +134,25 @@ class TestExtractFunctions(unittest.TestCase):
         self.assertEqual(
             result, "HP:0000001 - Phenotype 1; HP:0000002 - Phenotype 2 (excluded)"
         )
+        # As (id, label, excluded) tuples
+        result = extract_HPO_terms_from_phenopacket(phenopacket, as_pairs=True)
+        self.assertEqual(result, [("HP:0000001", "Phenotype 1", False)])
+        result = extract_HPO_terms_from_phenopacket(
+            phenopacket, ignore_excluded=False, as_pairs=True
+        )
+        self.assertEqual(
+            result,
+            [
+                ("HP:0000001", "Phenotype 1", False),
+                ("HP:0000002", "Phenotype 2", True),
+            ],
+        )
         # No phenotypicFeatures
         phenopacket2 = {"subject": {"id": "p2"}}
         self.assertEqual(extract_HPO_terms_from_phenopacket(phenopacket2), "")
+        self.assertEqual(
+            extract_HPO_terms_from_phenopacket(phenopacket2, as_pairs=True), []
+        )
 
     def test_extract_disease_terms_from_phenopacket(self):
         phenopacket = {
@@ -95,10 +168,40 @@ class TestExtractFunctions(unittest.TestCase):
             phenopacket, ignore_excluded=False
         )
         self.assertEqual(result, "OMIM:1 - Disease 1; OMIM:2 - Disease 2 (excluded)")
+        # As (id, label, excluded) tuples
+        result = extract_disease_terms_from_phenopacket(phenopacket, as_pairs=True)
+        self.assertEqual(result, [("OMIM:1", "Disease 1", False)])
         # No diseases
         phenopacket2 = {"subject": {"id": "p2"}}
         self.assertEqual(extract_disease_terms_from_phenopacket(phenopacket2), "")
 
+    def test_extract_terms_from_phenopackets_batch(self):
+        phenopackets = [
+            {
+                "subject": {"id": "p1"},
+                "phenotypicFeatures": [
+                    {"type": {"id": "HP:0000001", "label": "Phenotype 1"}},
+                ],
+                "diseases": [
+                    {"term": {"id": "OMIM:1", "label": "Disease 1"}, "excluded": 1},
+                ],
+            },
+            {"subject": {"id": "p2"}},
+        ]
+        self.assertEqual(
+            extract_HPO_terms_from_phenopackets(phenopackets),
+            ["HP:0000001 - Phenotype 1", ""],
+        )
+        self.assertEqual(
+            extract_disease_terms_from_phenopackets(phenopackets), ["", ""]
+        )
+        self.assertEqual(
+            extract_disease_terms_from_phenopackets(
+                phenopackets, ignore_excluded=False
+            ),
+            ["OMIM:1 - Disease 1 (excluded)", ""],
+        )
+
     def test_filter_phenopacket_by_onset(self):
         phenopacket = {
             "phenotypicFeatures": [
@@ -123,21 +226,32 @@ class TestExtractFunctions(unittest.TestCase):
             ],
         }
         # Filter by specific timestamp
-        filtered = filter_phenopacket_by_onset(dict(phenopacket), "2020-01-01")
+        filtered = filter_phenopacket_by_onset(phenopacket, "2020-01-01")
         self.assertEqual(len(filtered["phenotypicFeatures"]), 1)
         self.assertEqual(filtered["phenotypicFeatures"][0]["type"]["id"], "HP:1")
         self.assertEqual(len(filtered["diseases"]), 1)
         self.assertEqual(filtered["diseases"][0]["term"]["id"], "OMIM:1")
+        # Input phenopacket is not modified
+        self.assertEqual(len(phenopacket["phenotypicFeatures"]), 2)
+        self.assertEqual(len(phenopacket["diseases"]), 2)
         # Filter by earliest
-        filtered = filter_phenopacket_by_onset(dict(phenopacket), "earliest")
+        filtered = filter_phenopacket_by_onset(phenopacket, "earliest")
         self.assertEqual(
             filtered["phenotypicFeatures"][0]["onset"]["timestamp"], "2020-01-01"
         )
         # Filter by latest
-        filtered = filter_phenopacket_by_onset(dict(phenopacket), "latest")
+        filtered = filter_phenopacket_by_onset(phenopacket, "latest")
         self.assertEqual(
             filtered["phenotypicFeatures"][0]["onset"]["timestamp"], "2021-01-01"
         )
+        # Repeated filtering can reuse a precomputed index
+        onset_index = index_phenopacket_by_onset(phenopacket)
+        self.assertEqual(set(onset_index), {"2020-01-01", "2021-01-01"})
+        filtered = filter_phenopacket_by_onset(
+            phenopacket, "2021-01-01", onset_index=onset_index
+        )
+        self.assertEqual(filtered["phenotypicFeatures"][0]["type"]["id"], "HP:2")
+        self.assertEqual(filtered["diseases"][0]["term"]["id"], "OMIM:2")
 
 
 if __name__ == "__main__":